@@ -8,6 +8,7 @@ import asyncio
 import os
 import sys
 import wave
+from concurrent.futures import ThreadPoolExecutor
 
 import aiohttp
 from dotenv import load_dotenv
@@ -39,45 +40,46 @@ logger.remove(0)
 logger.add(sys.stderr, level="DEBUG")
 
 
-sounds = {}
+def _read_wav(full_path):
+    # Open the sound and convert it to bytes
+    with wave.open(full_path) as audio_file:
+        return OutputAudioRawFrame(
+            audio=audio_file.readframes(-1),
+            sample_rate=audio_file.getframerate(),
+            num_channels=audio_file.getnchannels(),
+        )
+
+
+def load_sounds(sound_files):
+    # Read all the sounds concurrently so their disk I/O overlaps
+    full_paths = [os.path.join(script_dir, "assets", file) for file in sound_files]
+    with ThreadPoolExecutor() as executor:
+        return dict(zip(sound_files, executor.map(_read_wav, full_paths)))
+
+
 sound_files = ["ding1.wav", "ding2.wav"]
 
 script_dir = os.path.dirname(__file__)
 
-for file in sound_files:
-    # Build the full path to the image file
-    full_path = os.path.join(script_dir, "assets", file)
-    # Get the filename without the extension to use as the dictionary key
-    filename = os.path.splitext(os.path.basename(full_path))[0]
-    # Open the image and convert it to bytes
-    with wave.open(full_path) as audio_file:
-        sounds[file] = OutputAudioRawFrame(
-            audio_file.readframes(-1), audio_file.getframerate(), audio_file.getnchannels()
-        )
-
+sounds = load_sounds(sound_files)
 
-class OutboundSoundEffectWrapper(FrameProcessor):
-    async def process_frame(self, frame: Frame, direction: FrameDirection):
-        await super().process_frame(frame, direction)
 
-        if isinstance(frame, LLMFullResponseEndFrame):
-            await self.push_frame(sounds["ding1.wav"])
-            # In case anything else downstream needs it
-            await self.push_frame(frame, direction)
-        else:
-            await self.push_frame(frame, direction)
+class SoundEffectWrapper(FrameProcessor):
+    """Plays a sound effect whenever a frame of the given marker type goes by."""
 
+    def __init__(self, marker_type: type, sound: OutputAudioRawFrame, **kwargs):
+        super().__init__(**kwargs)
+        self._marker_type = marker_type
+        # The sound frame is built once at load time and reused for every marker
+        self._sound = sound
 
-class InboundSoundEffectWrapper(FrameProcessor):
     async def process_frame(self, frame: Frame, direction: FrameDirection):
         await super().process_frame(frame, direction)
 
-        if isinstance(frame, OpenAILLMContextFrame):
-            await self.push_frame(sounds["ding2.wav"])
-            # In case anything else downstream needs it
-            await self.push_frame(frame, direction)
-        else:
-            await self.push_frame(frame, direction)
+        if isinstance(frame, self._marker_type):
+            await self.push_frame(self._sound)
+        # In case anything else downstream needs it
+        await self.push_frame(frame, direction)
 
 
 async def main():
@@ -112,8 +114,8 @@ async def main():
 
         context = OpenAILLMContext(messages)
         context_aggregator = llm.create_context_aggregator(context)
-        out_sound = OutboundSoundEffectWrapper()
-        in_sound = InboundSoundEffectWrapper()
+        out_sound = SoundEffectWrapper(LLMFullResponseEndFrame, sounds["ding1.wav"])
+        in_sound = SoundEffectWrapper(OpenAILLMContextFrame, sounds["ding2.wav"])
         fl = FrameLogger("LLM Out")
         fl2 = FrameLogger("Transcription In")
 
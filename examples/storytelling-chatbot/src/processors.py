@@ -1,8 +1,7 @@
+import asyncio
 import os
-import re
 
 import google.ai.generativelanguage as glm
-from async_timeout import timeout
 from loguru import logger
 from prompts import (
     CUE_ASSISTANT_TURN,
@@ -26,6 +25,118 @@ from pipecat.transports.services.daily import DailyTransportMessageFrame
 
 sounds = load_sounds(["talking.wav", "listening.wav", "ding.wav"])
 
+# App messages to the UI, built once like the sounds since they never change
+cue_assistant_turn = DailyTransportMessageFrame(CUE_ASSISTANT_TURN)
+cue_user_turn = DailyTransportMessageFrame(CUE_USER_TURN)
+
+# Story break tokens, as emitted by the LLM
+_BREAK_TOKENS = ("[break]", "[Break]")
+# Longest prefix of "[break]" that could still be completed by upcoming text
+_PARTIAL_BREAK_LEN = len("[break]") - 1
+# Texts longer than this still to be parsed are parsed off the event loop
+_THREADED_PARSE_LEN = 4096
+# Flattens line breaks in story pages to spaces
+_NEWLINE_TABLE = str.maketrans({"\n": " ", "\r": " "})
+
+
+def _scan_tokens(text: str, pos: int) -> tuple[int, int, str | None]:
+    """Finds the first image prompt or story break at or after `pos`.
+
+    Image prompts are <...> and don't span lines; story breaks are [break].
+
+    Returns:
+        A (start, end, image_prompt) tuple, where image_prompt is None for a
+        story break. (-1, -1, None) if there are no tokens.
+    """
+    image_pos = text.find("<", pos)
+    break_pos = text.find("[", pos)
+    while image_pos != -1 or break_pos != -1:
+        if break_pos == -1 or (image_pos != -1 and image_pos < break_pos):
+            end = text.find(">", image_pos + 1)
+            if end == -1:
+                # Nothing can be closed, so no later '<' will match either
+                image_pos = -1
+            elif text.find("\n", image_pos + 1, end) == -1:
+                return image_pos, end + 1, text[image_pos + 1 : end]
+            else:
+                image_pos = text.find("<", image_pos + 1)
+        else:
+            if text.startswith(_BREAK_TOKENS, break_pos):
+                return break_pos, break_pos + len(_BREAK_TOKENS[0]), None
+            break_pos = text.find("[", break_pos + 1)
+    return -1, -1, None
+
+
+def _scan_watermark(text: str, pos: int) -> int:
+    """Returns the lowest index at or after `pos` where a token could still start.
+
+    Assumes no token matched from `pos`, so only a token completed by text
+    appended later can start at or after the returned index.
+    """
+    watermark = len(text)
+    # An unmatched '<' might be closed by a later '>'
+    image_pos = text.find("<", pos)
+    if image_pos != -1:
+        watermark = image_pos
+    # An unmatched '[' can only be a partial break near the end of the text
+    break_pos = text.find("[", max(pos, len(text) - _PARTIAL_BREAK_LEN))
+    if break_pos != -1:
+        watermark = min(watermark, break_pos)
+    return watermark
+
+
+def _parse_story_text(text: str, pos: int) -> tuple[list[tuple[str | None, str | None]], str, int]:
+    """Removes image prompts and story breaks from `text`, scanning from `pos`.
+
+    Tokens are removed in order of appearance.
+
+    Returns:
+        A list of (image_prompt, page) items with exactly one of them set, the
+        remaining text, and the offset to resume scanning from.
+    """
+    items = []
+    while True:
+        # Find the first image prompt or story break in a single pass,
+        # skipping the prefix already known to be free of tokens
+        start, end, image_prompt = _scan_tokens(text, pos)
+
+        # If neither pattern is found, we're done processing
+        if start == -1:
+            return items, text, _scan_watermark(text, pos)
+
+        if image_prompt is not None:
+            # Remove the image prompt from the text
+            text = text[:start] + text[end:]
+            # Splicing may complete a break that started just before the prompt
+            pos = max(0, start - _PARTIAL_BREAK_LEN)
+            items.append((image_prompt, None))
+        else:
+            before_break = text[:start]
+            if "\n" in before_break or "\r" in before_break:
+                before_break = before_break.translate(_NEWLINE_TABLE)
+            before_break = before_break.strip()
+
+            if len(before_break) > 2:
+                items.append((None, before_break))
+
+            # Keep the remainder (if any) in the buffer
+            text = text[end:].lstrip()
+            pos = 0
+
+
+# Pre-split the image generation template around its "%s" so building a
+# prompt is a plain concatenation
+_IMAGE_GEN_PREFIX, _, _IMAGE_GEN_SUFFIX = IMAGE_GEN_PROMPT.partition("%s")
+_IMAGE_GEN_PRESPLIT = IMAGE_GEN_PROMPT.count("%") == 1 and "%s" in IMAGE_GEN_PROMPT
+
+
+def _image_gen_prompt(description: str) -> str:
+    if _IMAGE_GEN_PRESPLIT:
+        return _IMAGE_GEN_PREFIX + description + _IMAGE_GEN_SUFFIX
+    # Fall back to formatting for templates with other placeholders
+    return IMAGE_GEN_PROMPT % description
+
+
 # -------------- Frame Types ------------- #
 
 
@@ -73,39 +184,45 @@ class StoryImageProcessor(FrameProcessor):
     async def process_frame(self, frame: Frame, direction: FrameDirection):
         await super().process_frame(frame, direction)
 
-        if isinstance(frame, StoryPageFrame):
-            # Special syntax for the first page
-            if self.pages == []:
-                prompt = FIRST_IMAGE_PROMPT % frame.text
-            else:
-                prompt = NEXT_IMAGE_PROMPT % (
-                    " ".join(self.pages),
-                    "; ".join(self.image_descriptions),
-                    frame.text,
-                )
-
-            await self.start_ttfb_metrics()
-            # TODO: This is coupled to google implementation now
-            txt = glm.Content(role="user", parts=[glm.Part(text=prompt)])
-            llm_response = await self._llm_service._client.generate_content_async(
-                contents=[txt], stream=False
-            )
-            image_description = llm_response.text
-            self.pages.append(frame.text)
-            self.image_descriptions.append(image_description)
-            try:
-                async with timeout(15):
-                    async for i in self._image_gen_service.run_image_gen(
-                        IMAGE_GEN_PROMPT % image_description
-                    ):
-                        await self.push_frame(i)
-            except TimeoutError:
-                logger.debug("Image gen timeout")
-                pass
-            await self.stop_ttfb_metrics()
-            # Push the StoryPageFrame so it gets TTS
+        if not isinstance(frame, StoryPageFrame):
             await self.push_frame(frame)
+            return
+
+        # Special syntax for the first page
+        if self.pages == []:
+            prompt = FIRST_IMAGE_PROMPT % frame.text
         else:
+            prompt = NEXT_IMAGE_PROMPT % (
+                " ".join(self.pages),
+                "; ".join(self.image_descriptions),
+                frame.text,
+            )
+
+        await self.start_ttfb_metrics()
+        # TODO: This is coupled to google implementation now
+        txt = glm.Content(role="user", parts=[glm.Part(text=prompt)])
+        llm_response = await self._llm_service._client.generate_content_async(
+            contents=[txt], stream=False
+        )
+        image_description = llm_response.text
+        self.pages.append(frame.text)
+        self.image_descriptions.append(image_description)
+        try:
+            await asyncio.wait_for(
+                self._drain(
+                    self._image_gen_service.run_image_gen(_image_gen_prompt(image_description))
+                ),
+                timeout=15,
+            )
+        except asyncio.TimeoutError:
+            logger.debug("Image gen timeout")
+        await self.stop_ttfb_metrics()
+        # Push the StoryPageFrame so it gets TTS
+        await self.push_frame(frame)
+
+    async def _drain(self, generator):
+        # Push every frame yielded by the image generation service
+        async for frame in generator:
             await self.push_frame(frame)
 
 
@@ -116,8 +233,13 @@ class StoryProcessor(FrameProcessor):
 
     Attributes:
         _messages (list): A list of llm messages.
-        _text (str): A buffer to store the text from text frames.
+        _text_parts (list): A buffer of text chunks from text frames, joined when scanned.
+        _text_len (int): The total length of the buffered text chunks.
+        _maybe_has_token (bool): Whether the buffer may contain a token start ('<' or '[').
+        _scan_pos (int): Buffer offset before which no token can start, so scans resume there.
         _story (list): A list to store the story sentences, or 'pages'.
+        _handlers (dict): Frame handlers keyed by frame type (None to pass through).
+        _handler_cache (dict): Handlers resolved for concrete frame types.
 
     Methods:
         process_frame: Processes a frame and removes any [break] or [image] tokens.
@@ -126,70 +248,113 @@ class StoryProcessor(FrameProcessor):
     def __init__(self, messages, story):
         super().__init__()
         self._messages = messages
-        self._text = ""
+        self._text_parts: list[str] = []
+        self._text_len = 0
+        self._maybe_has_token = False
+        self._scan_pos = 0
         self._story = story
+        # Frame handlers, keyed by the frame type they handle
+        self._handlers = {
+            UserStoppedSpeakingFrame: self._handle_user_stopped_speaking,
+            TextFrame: self._handle_text,
+            LLMFullResponseEndFrame: self._handle_llm_response_end,
+            # Our own frames are already processed, so they pass through
+            StoryPageFrame: None,
+            StoryImageFrame: None,
+            StoryPromptFrame: None,
+        }
+        # Handlers resolved for concrete frame types (None to pass through)
+        self._handler_cache = {}
+
+    def _handler_for(self, frame_type: type):
+        try:
+            return self._handler_cache[frame_type]
+        except KeyError:
+            pass
+        # Resolve subclasses (e.g. transcriptions are text frames) once per type
+        handler = next(
+            (self._handlers[cls] for cls in frame_type.__mro__ if cls in self._handlers), None
+        )
+        self._handler_cache[frame_type] = handler
+        return handler
 
     async def process_frame(self, frame: Frame, direction: FrameDirection):
         await super().process_frame(frame, direction)
 
-        if isinstance(frame, UserStoppedSpeakingFrame):
-            # Send an app message to the UI
-            await self.push_frame(DailyTransportMessageFrame(CUE_ASSISTANT_TURN))
-            await self.push_frame(sounds["talking"])
+        handler = self._handler_for(type(frame))
+        if handler:
+            await handler(frame)
+        else:
+            # Anything we don't handle passes through
+            await self.push_frame(frame)
 
-        elif isinstance(frame, TextFrame):
-            # Add new text to the buffer
-            # (character replace hack to fix TTS sequencing)
-            self._text += frame.text.replace(";", "—")
-            # Process any complete patterns in the order they appear
+    async def _handle_user_stopped_speaking(self, frame: UserStoppedSpeakingFrame):
+        # Send an app message to the UI
+        await self.push_frame(cue_assistant_turn)
+        await self.push_frame(sounds["talking"])
+
+    async def _handle_text(self, frame: TextFrame):
+        # Add new text to the buffer
+        # (character replace hack to fix TTS sequencing)
+        text = frame.text.replace(";", "—")
+        self._text_parts.append(text)
+        self._text_len += len(text)
+        self._maybe_has_token |= "<" in text or "[" in text
+        # Process any complete patterns in the order they appear. Tokens
+        # always start with '<' or '[', so skip scanning until one shows up.
+        if self._maybe_has_token:
             await self.process_text_content()
 
+    async def _handle_llm_response_end(self, frame: LLMFullResponseEndFrame):
         # End of a full LLM response
         # Driven by the prompt, the LLM should have asked the user for input
-        elif isinstance(frame, LLMFullResponseEndFrame):
-            # We use a different frame type, as to avoid image generation ingest
-            await self.push_frame(StoryPromptFrame(self._text))
-            self._text = ""
-            await self.push_frame(frame)
-            # Send an app message to the UI
-            await self.push_frame(DailyTransportMessageFrame(CUE_USER_TURN))
-            await self.push_frame(sounds["listening"])
-
-        # Anything that is not a TextFrame pass through
-        else:
-            await self.push_frame(frame)
+        # We use a different frame type, as to avoid image generation ingest
+        text = "".join(self._text_parts)
+        self._text_parts = []
+        self._text_len = 0
+        self._maybe_has_token = False
+        self._scan_pos = 0
+        await self.push_frame(StoryPromptFrame(text))
+        await self.push_frame(frame)
+        # Send an app message to the UI
+        await self.push_frame(cue_user_turn)
+        await self.push_frame(sounds["listening"])
 
     async def process_text_content(self):
         """Process text content in order of appearance, handling both image prompts and story breaks."""
-        while True:
-            # Find the first occurrence of each pattern
-            image_match = re.search(r"<(.*?)>", self._text)
-            break_match = re.search(r"\[[bB]reak\]", self._text)
-
-            # If neither pattern is found, we're done processing
-            if not image_match and not break_match:
-                break
-
-            # Find which pattern comes first in the text
-            image_pos = image_match.start() if image_match else float("inf")
-            break_pos = break_match.start() if break_match else float("inf")
-
-            if image_pos < break_pos:
-                # Process image prompt first
-                image_prompt = image_match.group(1)
-                # Remove the image prompt from the text
-                self._text = self._text[: image_match.start()] + self._text[image_match.end() :]
+        text = "".join(self._text_parts)
+        # Only the text after the scan offset gets parsed
+        if self._text_len - self._scan_pos > _THREADED_PARSE_LEN:
+            # Long texts are parsed in a worker thread to keep the event loop responsive
+            parse = asyncio.ensure_future(
+                asyncio.to_thread(_parse_story_text, text, self._scan_pos)
+            )
+            try:
+                items, text, self._scan_pos = await asyncio.shield(parse)
+            except asyncio.CancelledError:
+                # The worker thread can't be stopped, so wait for it and keep
+                # its result. Otherwise the parsed pages stay in the buffer and
+                # come out late, after the interruption. This means cancelling
+                # (e.g. cancel_task() on interruption) waits for the thread too.
+                items, text, self._scan_pos = await parse
+                self._store_parsed_text(items, text)
+                raise
+        else:
+            items, text, self._scan_pos = _parse_story_text(text, self._scan_pos)
+
+        self._store_parsed_text(items, text)
+
+        for image_prompt, page in items:
+            if image_prompt is not None:
                 await self.push_frame(StoryImageFrame(image_prompt))
             else:
-                # Process story break first
-                parts = re.split(r"\[[bB]reak\]", self._text, flags=re.IGNORECASE, maxsplit=1)
-                before_break = parts[0].replace("\n", " ").strip()
-
-                if len(before_break) > 2:
-                    self._story.append(before_break)
-                    await self.push_frame(StoryPageFrame(before_break))
-                    # await self.push_frame(sounds["ding"])
-                    await self.push_frame(DailyTransportMessageFrame(CUE_ASSISTANT_TURN))
-
-                # Keep the remainder (if any) in the buffer
-                self._text = parts[1].strip() if len(parts) > 1 else ""
+                await self.push_frame(StoryPageFrame(page))
+                # await self.push_frame(sounds["ding"])
+                await self.push_frame(cue_assistant_turn)
+
+    def _store_parsed_text(self, items, text: str):
+        self._text_parts = [text] if text else []
+        self._text_len = len(text)
+        # A partial token may still be completed by upcoming text
+        self._maybe_has_token = self._scan_pos < len(text)
+        self._story.extend(page for _, page in items if page is not None)
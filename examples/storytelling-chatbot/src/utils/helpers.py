@@ -1,5 +1,6 @@
 import os
 import wave
+from concurrent.futures import ThreadPoolExecutor
 
 from PIL import Image
 
@@ -23,20 +24,24 @@ def load_images(image_files):
     return images
 
 
-def load_sounds(sound_files):
-    sounds = {}
+def _read_wav(full_path):
+    # Open the sound and convert it to bytes
+    with wave.open(full_path) as audio_file:
+        return OutputAudioRawFrame(
+            audio=audio_file.readframes(-1),
+            sample_rate=audio_file.getframerate(),
+            num_channels=audio_file.getnchannels(),
+        )
 
-    for file in sound_files:
-        # Build the full path to the sound file
-        full_path = os.path.join(script_dir, "../assets", file)
-        # Get the filename without the extension to use as the dictionary key
-        filename = os.path.splitext(os.path.basename(full_path))[0]
-        # Open the sound and convert it to bytes
-        with wave.open(full_path) as audio_file:
-            sounds[filename] = OutputAudioRawFrame(
-                audio=audio_file.readframes(-1),
-                sample_rate=audio_file.getframerate(),
-                num_channels=audio_file.getnchannels(),
-            )
 
-    return sounds
+def load_sounds(sound_files):
+    # Build the full path to each sound file
+    full_paths = [os.path.join(script_dir, "../assets", file) for file in sound_files]
+    # Read all the sounds concurrently so their disk I/O overlaps
+    with ThreadPoolExecutor() as executor:
+        frames = executor.map(_read_wav, full_paths)
+        # Use the filename without the extension as the dictionary key
+        return {
+            os.path.splitext(os.path.basename(path))[0]: frame
+            for path, frame in zip(full_paths, frames)
+        }